@@ -1,9 +1,17 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response
 from app.config import Config
 from app.github_auth import GitHubAuth
 from app.docker_builder import DockerBuilder
 from app.k8s_deployer import KubernetesDeployer
+from app.deploy_pipeline import DeployPipeline, is_valid_name
+from app.response_cache import ResponseCache
+from app.rate_limiter import RateLimiter
+from app.scale_to_zero import ActivityTracker, IdleController, Activator
+from app.webhooks import WebhookRedeployer, verify_signature
 import os
+import requests
+import threading
+import zlib
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -11,6 +19,66 @@ app.config.from_object(Config)
 # Initialize services
 docker_builder = DockerBuilder()
 k8s_deployer = KubernetesDeployer()
+response_cache = ResponseCache()
+rate_limiter = RateLimiter()
+activity_tracker = ActivityTracker()
+
+def invalidate_deployment(name):
+    """Drop cached deployment data after a deploy, sleep or wake changed it"""
+    response_cache.invalidate('deployments', f"deployment:{name}")
+
+def on_deploy_finished(deploy, success, result):
+    """Refresh cached deployment data and follow the deployed branch"""
+    invalidate_deployment(deploy['name'])
+    # Pushes to the deployed branch now redeploy this app automatically
+    if success and result['branch']:
+        webhook_redeployer.register(deploy['repo_url'], result['branch'], deploy['name'], replicas=deploy['replicas'])
+
+deploy_pipeline = DeployPipeline(docker_builder, k8s_deployer, on_finish=on_deploy_finished)
+activator = Activator(k8s_deployer, activity_tracker, on_change=invalidate_deployment)
+idle_controller = IdleController(k8s_deployer, activity_tracker, on_change=invalidate_deployment)
+idle_controller.start()
+webhook_redeployer = WebhookRedeployer(deploy_pipeline)
+webhook_redeployer.start()
+deploy_pipeline.start_sweeper()
+
+# Followed log streams stay open for minutes; cap them so they cannot take
+# every thread of a worker and stall the dashboard
+follow_slots = threading.BoundedSemaphore(Config.LOG_FOLLOW_MAX_STREAMS)
+
+# Headers that only apply to a single connection and must not be proxied
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailers', 'transfer-encoding', 'upgrade', 'host', 'content-length'
+}
+
+@app.before_request
+def route_app_hosts():
+    """Requests for <name>.<ACTIVATOR_DOMAIN> are app traffic, not dashboard requests.
+
+    Each app gets its own origin, so its pages cannot script the dashboard
+    or read its session cookie.
+    """
+    name = app_name_from_host(request.host)
+    if name:
+        return proxy_app(name)
+    return None
+
+@app.before_request
+def limit_api_rate():
+    """Apply the per-user token bucket to API calls"""
+    if not request.path.startswith('/api/') or 'access_token' not in session:
+        return None
+    
+    user = (session.get('user') or {}).get('login') or 'anonymous'
+    allowed, retry_after = rate_limiter.acquire(user)
+    if allowed:
+        return None
+    
+    response = jsonify({'error': 'Too many requests', 'retry_after': retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
 
 @app.route('/')
 def index():
@@ -66,18 +134,30 @@ def get_repos():
     if 'access_token' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    repos = GitHubAuth.get_user_repos(session['access_token'])
+    access_token = session['access_token']
+    
+    def fetch_repos():
+        repos = GitHubAuth.get_user_repos(access_token)
+        
+        # Format repo data
+        return [{
+            'name': repo.get('name'),
+            'full_name': repo.get('full_name'),
+            'description': repo.get('description'),
+            'clone_url': repo.get('clone_url'),
+            'language': repo.get('language'),
+            'updated_at': repo.get('updated_at')
+        } for repo in repos]
     
-    # Format repo data
-    formatted_repos = [{
-        'name': repo.get('name'),
-        'full_name': repo.get('full_name'),
-        'description': repo.get('description'),
-        'clone_url': repo.get('clone_url'),
-        'language': repo.get('language'),
-        'updated_at': repo.get('updated_at')
-    } for repo in repos]
+    # Repos are private to each user, so the cache key is per login
+    login = (session.get('user') or {}).get('login')
+    if not login:
+        return jsonify({'repos': fetch_repos()})
     
+    formatted_repos = response_cache.get_or_fetch(
+        f"repos:{login}", Config.REPOS_CACHE_TTL, fetch_repos,
+        refresh=request.args.get('refresh') == '1'
+    )
     return jsonify({'repos': formatted_repos})
 
 @app.route('/api/deploy', methods=['POST'])
@@ -95,49 +175,30 @@ def deploy():
     
     # Sanitize repo name for Docker/K8s
     safe_name = repo_name.lower().replace('_', '-').replace('.', '-')
+    if not is_valid_name(safe_name):
+        return jsonify({'error': 'Repository name is not a valid deployment name'}), 400
     
     try:
-        # Step 1: Build and push Docker image
-        success, result = docker_builder.build_and_push(
+        # Clone, build, push and deploy in the background; resumes from the
+        # last finished stage if an earlier attempt for this commit was interrupted
+        deploy_id, error = deploy_pipeline.start(
             repo_url=repo_url,
-            image_name=safe_name,
-            tag='latest'
-        )
-        
-        if not success:
-            return jsonify({
-                'success': False,
-                'stage': 'docker_build',
-                'error': result
-            }), 500
-        
-        image_name = result
-        
-        # Step 2: Detect port based on project type (stored during build)
-        port = getattr(docker_builder, 'last_detected_port', 8000)
-        
-        # Step 2: Deploy to Kubernetes
-        success, result = k8s_deployer.deploy_application(
             name=safe_name,
-            image=image_name,
-            port=port,
             replicas=2
         )
-        
-        if not success:
+        if not deploy_id:
             return jsonify({
                 'success': False,
-                'stage': 'k8s_deploy',
-                'error': result
-            }), 500
+                'stage': 'conflict',
+                'error': error
+            }), 409
         
         return jsonify({
             'success': True,
-            'message': 'Deployment successful',
-            'image': image_name,
+            'deploy_id': deploy_id,
             'deployment': safe_name,
-            'port': port
-        })
+            'status': 'running'
+        }), 202
     
     except Exception as e:
         return jsonify({
@@ -145,6 +206,43 @@ def deploy():
             'error': str(e)
         }), 500
 
+@app.route('/api/deploy/<int:deploy_id>')
+def deploy_status(deploy_id):
+    """Get the progress or outcome of a deploy"""
+    if 'access_token' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    deploy = deploy_pipeline.journal.get(deploy_id)
+    if not deploy:
+        return jsonify({'error': 'Deploy not found'}), 404
+    
+    response = {
+        'success': deploy['status'] == 'succeeded',
+        'deploy_id': deploy_id,
+        'status': deploy['status'],
+        'deployment': deploy['name'],
+        'commit': deploy['commit_sha'],
+        'stages': deploy['stages'],
+        'trace_id': deploy['trace_id'],
+        'timings': deploy['timings']
+    }
+    if deploy['status'] == 'succeeded':
+        result = deploy['result']
+        response.update({
+            'message': 'Deployment successful',
+            'image': result['image'],
+            'image_size': result['image_size'],
+            'port': result['port'],
+            'commit': result['commit'],
+            'resumed_stages': result['resumed_stages']
+        })
+    elif deploy['status'] != 'running':
+        response.update({
+            'stage': deploy['error_stage'],
+            'error': deploy['error'] or f"Deploy {deploy['status']}"
+        })
+    return jsonify(response)
+
 @app.route('/api/deployments')
 def get_deployments():
     """Get all deployments"""
@@ -152,8 +250,14 @@ def get_deployments():
         return jsonify({'error': 'Not authenticated'}), 401
     
     try:
-        deployments = k8s_deployer.list_deployments()
-        return jsonify({'deployments': deployments})
+        deployments = response_cache.get_or_fetch(
+            'deployments', Config.API_CACHE_TTL, k8s_deployer.list_deployments,
+            refresh=request.args.get('refresh') == '1'
+        )
+        # App links go through the activator so visits count as activity
+        return jsonify({'deployments': [
+            {**deployment, 'url': app_url(deployment['name'])} for deployment in deployments
+        ]})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -164,23 +268,96 @@ def get_deployment_status(name):
         return jsonify({'error': 'Not authenticated'}), 401
     
     try:
-        status = k8s_deployer.get_deployment_status(name)
+        status = response_cache.get_or_fetch(
+            f"deployment:{name}", Config.API_CACHE_TTL,
+            lambda: k8s_deployer.get_deployment_status(name)
+        )
         if status:
             return jsonify({'status': status})
         return jsonify({'error': 'Deployment not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def _gzip_stream(chunks, flush_each=False):
+    """Gzip-encode a stream of text chunks without buffering the whole body"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if flush_each:
+            # Follow mode: push each line to the client as soon as it arrives
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.route('/api/deployment/<name>/logs')
+def get_deployment_logs(name):
+    """Stream logs from all replicas of a deployment"""
+    if 'access_token' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    since_seconds = request.args.get('sinceSeconds', type=int)
+    tail_lines = request.args.get('tailLines', type=int)
+    if (since_seconds is not None and since_seconds <= 0) or (tail_lines is not None and tail_lines < 0):
+        return jsonify({'error': 'sinceSeconds must be positive and tailLines non-negative'}), 400
+    follow = request.args.get('follow', '').lower() in ('1', 'true', 'yes')
+    if follow and not follow_slots.acquire(blocking=False):
+        response = jsonify({'error': 'Too many followed log streams open; close one and retry'})
+        response.status_code = 429
+        response.headers['Retry-After'] = '10'
+        return response
+    
+    streaming = False
+    try:
+        # Pod streams are opened here, so API errors still become a JSON 500
+        lines = k8s_deployer.stream_logs(
+            name,
+            since_seconds=since_seconds,
+            tail_lines=tail_lines,
+            follow=follow,
+            max_follow_seconds=Config.LOG_FOLLOW_MAX_SECONDS
+        )
+        if lines is None:
+            return jsonify({'error': 'No pods found for deployment'}), 404
+        
+        headers = {'X-Accel-Buffering': 'no', 'Cache-Control': 'no-cache'}
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            headers['Content-Encoding'] = 'gzip'
+            headers['Vary'] = 'Accept-Encoding'
+            body = _gzip_stream(lines, flush_each=follow)
+        else:
+            body = (line.encode('utf-8') for line in lines)
+        
+        response = Response(body, mimetype='text/plain', headers=headers)
+        if follow:
+            # The server closes the response when the stream ends or the client goes away
+            response.call_on_close(follow_slots.release)
+            streaming = True
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if follow and not streaming:
+            follow_slots.release()
+
 @app.route('/api/deployment/<name>', methods=['DELETE'])
 def delete_deployment(name):
     """Delete deployment"""
     if 'access_token' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
+    if not is_valid_name(name):
+        return jsonify({'error': 'Invalid deployment name'}), 400
+    
     try:
         # Delete from Kubernetes
         success, message = k8s_deployer.delete_deployment(name)
+        invalidate_deployment(name)
         if success:
+            # Drop any half-finished deploy of this app so it is not resumed
+            deploy_pipeline.forget(name)
+            webhook_redeployer.unregister(name)
+            
             # Also delete Docker image to clean up
             try:
                 import subprocess
@@ -207,6 +384,117 @@ def delete_deployment(name):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/webhooks/github', methods=['POST'])
+def github_webhook():
+    """Receive GitHub push events and schedule redeploys"""
+    if not Config.GITHUB_WEBHOOK_SECRET:
+        return jsonify({'error': 'Webhook secret is not configured'}), 503
+    
+    body = request.get_data()
+    if not verify_signature(Config.GITHUB_WEBHOOK_SECRET, body, request.headers.get('X-Hub-Signature-256')):
+        return jsonify({'error': 'Invalid signature'}), 401
+    
+    event = request.headers.get('X-GitHub-Event')
+    if event == 'ping':
+        return jsonify({'message': 'pong'})
+    if event != 'push':
+        return jsonify({'message': f'Ignored event: {event}'}), 202
+    
+    payload = request.get_json(silent=True)
+    if not payload:
+        return jsonify({'error': 'Invalid payload'}), 400
+    
+    scheduled = webhook_redeployer.handle_push(payload)
+    return jsonify({'scheduled': scheduled}), 202
+
+def proxy_app(name):
+    """Activator: wake a sleeping app if needed, then forward the request to it"""
+    # Only ever wake or forward to apps this platform deployed
+    if not activator.is_managed(name):
+        return jsonify({'error': 'Application not found'}), 404
+    
+    success, upstream = activator.activate(name)
+    if not success:
+        return jsonify({'error': f'Application unavailable: {upstream}'}), 503
+    
+    # App hosts never receive the dashboard's cookie; strip it anyway in case
+    # the dashboard is ever served under a shared parent domain
+    headers = {
+        k: v for k, v in request.headers
+        if k.lower() not in HOP_BY_HOP_HEADERS and k.lower() not in ('cookie', 'authorization')
+    }
+    app_cookies = [
+        f"{k}={v}" for k, v in request.cookies.items()
+        if k != app.config['SESSION_COOKIE_NAME']
+    ]
+    if app_cookies:
+        headers['Cookie'] = '; '.join(app_cookies)
+    headers['X-Forwarded-Host'] = request.host
+    headers['X-Forwarded-Proto'] = request.scheme
+    
+    # Forward the raw query string so repeated keys survive
+    url = f"{upstream}{request.path}"
+    if request.query_string:
+        url = f"{url}?{request.query_string.decode('latin-1')}"
+    
+    try:
+        upstream_response = requests.request(
+            method=request.method,
+            url=url,
+            headers=headers,
+            data=request.get_data(),
+            allow_redirects=False,
+            stream=True,
+            timeout=(5, 60)
+        )
+    except requests.RequestException as e:
+        return jsonify({'error': f'Application unavailable: {e}'}), 502
+    
+    response_headers = []
+    for k, v in upstream_response.raw.headers.items():
+        # The body is re-streamed decoded, so its original encoding no longer applies
+        if k.lower() in HOP_BY_HOP_HEADERS or k.lower() == 'content-encoding':
+            continue
+        if k.lower() == 'set-cookie':
+            v = _app_cookie(v)
+            if v is None:
+                continue
+        response_headers.append((k, v))
+    
+    def body():
+        try:
+            for chunk in upstream_response.iter_content(chunk_size=8192):
+                yield chunk
+        finally:
+            upstream_response.close()
+    
+    return Response(body(), status=upstream_response.status_code, headers=response_headers)
+
+def _app_cookie(set_cookie):
+    """Keep an app's cookie on the app's own host; never let it replace the session"""
+    name = set_cookie.split('=', 1)[0].strip()
+    if name == app.config['SESSION_COOKIE_NAME']:
+        return None
+    return ';'.join(
+        part for part in set_cookie.split(';')
+        if not part.strip().lower().startswith('domain=')
+    )
+
+def app_name_from_host(host):
+    """Return the app a <name>.<ACTIVATOR_DOMAIN> host refers to, or None"""
+    hostname = host.split(':', 1)[0].lower()
+    suffix = f".{Config.ACTIVATOR_DOMAIN}"
+    if not hostname.endswith(suffix):
+        return None
+    name = hostname[:-len(suffix)]
+    return name if is_valid_name(name) else None
+
+def app_url(name):
+    """URL of an app behind the activator, on the same port as the dashboard"""
+    port = request.host.rsplit(':', 1)[1] if ':' in request.host else None
+    host = f"{name}.{Config.ACTIVATOR_DOMAIN}"
+    return f"{request.scheme}://{host}:{port}" if port else f"{request.scheme}://{host}"
+
 @app.route('/logout')
 def logout():
     """Logout user"""
@@ -6,6 +6,7 @@ load_dotenv()
 class Config:
     # Flask config
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
+    SESSION_COOKIE_SAMESITE = 'Lax'
     
     # GitHub OAuth
     GITHUB_CLIENT_ID = os.getenv('GITHUB_CLIENT_ID')
@@ -22,3 +23,46 @@ class Config:
     
     # App settings
     DEPLOYMENT_DIR = os.getenv('DEPLOYMENT_DIR', './deployments')
+    
+    # Followed log streams end after this long, and each worker serves at most
+    # LOG_FOLLOW_MAX_STREAMS of them so some of its threads stay free for the dashboard
+    LOG_FOLLOW_MAX_SECONDS = int(os.getenv('LOG_FOLLOW_MAX_SECONDS', '100'))
+    LOG_FOLLOW_MAX_STREAMS = int(os.getenv('LOG_FOLLOW_MAX_STREAMS', '4'))
+    
+    # Deploy pipeline journal (resumable deploys)
+    DEPLOY_JOURNAL_PATH = os.getenv('DEPLOY_JOURNAL_PATH', os.path.join(DEPLOYMENT_DIR, 'journal.db'))
+    DEPLOY_WORKSPACE_DIR = os.getenv('DEPLOY_WORKSPACE_DIR', os.path.join(DEPLOYMENT_DIR, 'workspaces'))
+    DEPLOY_READY_TIMEOUT = int(os.getenv('DEPLOY_READY_TIMEOUT', '60'))
+    DEPLOY_LEASE_SECONDS = int(os.getenv('DEPLOY_LEASE_SECONDS', '60'))  # renewed while a deploy runs
+    DEPLOY_SWEEP_INTERVAL = int(os.getenv('DEPLOY_SWEEP_INTERVAL', '30'))
+    DEPLOY_MAX_ATTEMPTS = int(os.getenv('DEPLOY_MAX_ATTEMPTS', '3'))
+    DEPLOY_RETRY_DELAY = int(os.getenv('DEPLOY_RETRY_DELAY', '60'))
+    
+    # Dashboard API caching and per-user rate limiting
+    API_STATE_PATH = os.getenv('API_STATE_PATH', os.path.join(DEPLOYMENT_DIR, 'api_state.db'))
+    API_CACHE_TTL = float(os.getenv('API_CACHE_TTL', '5'))
+    REPOS_CACHE_TTL = float(os.getenv('REPOS_CACHE_TTL', '60'))
+    RATE_LIMIT_PER_SECOND = float(os.getenv('RATE_LIMIT_PER_SECOND', '5'))
+    RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', '20'))
+    
+    # Scale-to-zero: idle apps are scaled down and woken by the activator proxy.
+    # Only traffic through the activator counts as activity, so this is opt-in (0 disables)
+    IDLE_TIMEOUT_SECONDS = int(os.getenv('IDLE_TIMEOUT_SECONDS', '0'))
+    IDLE_CHECK_INTERVAL = int(os.getenv('IDLE_CHECK_INTERVAL', '60'))
+    ACTIVATOR_WAKE_TIMEOUT = int(os.getenv('ACTIVATOR_WAKE_TIMEOUT', '60'))
+    # Where the activator forwards to; the default is the service's LoadBalancer/NodePort on this host
+    ACTIVATOR_UPSTREAM = os.getenv('ACTIVATOR_UPSTREAM', 'http://localhost:{port}')
+    # Apps are served through the activator at <name>.<ACTIVATOR_DOMAIN> (*.localhost resolves locally)
+    ACTIVATOR_DOMAIN = os.getenv('ACTIVATOR_DOMAIN', 'localhost')
+    
+    # GitHub push webhooks (auto-redeploy)
+    GITHUB_WEBHOOK_SECRET = os.getenv('GITHUB_WEBHOOK_SECRET')
+    WEBHOOK_DEBOUNCE_SECONDS = int(os.getenv('WEBHOOK_DEBOUNCE_SECONDS', '30'))
+    WEBHOOK_MAX_WAIT_SECONDS = int(os.getenv('WEBHOOK_MAX_WAIT_SECONDS', '300'))  # from the first pending push
+    WEBHOOK_CLAIM_SECONDS = int(os.getenv('WEBHOOK_CLAIM_SECONDS', '900'))
+    
+    # Deploy tracing: comma-separated exporters ('json', 'otlp'); empty disables export
+    TRACE_EXPORTERS = os.getenv('TRACE_EXPORTERS', 'json')
+    TRACE_JSON_PATH = os.getenv('TRACE_JSON_PATH', os.path.join(DEPLOYMENT_DIR, 'traces.jsonl'))
+    OTLP_ENDPOINT = os.getenv('OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+    TRACE_SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'localkubelab')
@@ -0,0 +1,252 @@
+import json
+import os
+from contextlib import contextmanager
+import socket
+import sqlite3
+import time
+import uuid
+from app.config import Config
+
+# Columns added after the first release of the journal, for in-place upgrades
+_DEPLOY_COLUMNS = {
+    'owner': 'TEXT',
+    'lease_until': 'REAL NOT NULL DEFAULT 0',
+    'replicas': 'INTEGER NOT NULL DEFAULT 2',
+    'branch': 'TEXT',
+    'trigger': 'TEXT',
+    'attempts': 'INTEGER NOT NULL DEFAULT 0',
+    'error': 'TEXT',
+    'error_stage': 'TEXT',
+    'result': 'TEXT',
+    'timings': 'TEXT',
+    'trace_id': 'TEXT',
+}
+
+_owner = {}
+
+def process_owner():
+    """Identify this process uniquely, even if a restart reuses its PID"""
+    pid = os.getpid()
+    if pid not in _owner:
+        _owner[pid] = f"{socket.gethostname()}:{pid}:{uuid.uuid4().hex[:8]}"
+    return _owner[pid]
+
+
+class DeployJournal:
+    """Durable record of deploy pipeline progress, shared by all workers.
+
+    A running deploy holds a lease that its worker keeps renewing. Once the
+    lease runs out the worker is assumed dead and the deploy can be resumed
+    by anyone, whatever PID the new worker happens to have.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or Config.DEPLOY_JOURNAL_PATH
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS deploys (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    repo_url TEXT NOT NULL,
+                    commit_sha TEXT,
+                    workspace TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            existing = {row['name'] for row in conn.execute("PRAGMA table_info(deploys)")}
+            for column, definition in _DEPLOY_COLUMNS.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE deploys ADD COLUMN {column} {definition}")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS stages (
+                    deploy_id INTEGER NOT NULL,
+                    stage TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    completed_at REAL NOT NULL,
+                    PRIMARY KEY (deploy_id, stage)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS deploys_name ON deploys (name, status)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """Exclusive write transaction, for read-then-write decisions"""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    def acquire(self, name, repo_url, commit_sha, workspace, replicas, branch, trigger, lease_seconds):
+        """Claim the deploy of an app for this process.
+
+        Resumes the latest unfinished deploy when it is for the same source,
+        otherwise abandons it and starts a new one. Returns (deploy, resumed),
+        or (None, False) if another live worker holds the deploy.
+        """
+        owner = process_owner()
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT * FROM deploys WHERE name = ? AND status IN ('running', 'failed') "
+                "ORDER BY id DESC LIMIT 1",
+                (name,)
+            ).fetchone()
+            if row and row['status'] == 'running' and row['lease_until'] > now and row['owner'] != owner:
+                return None, False
+
+            if row and commit_sha and row['repo_url'] == repo_url and row['commit_sha'] == commit_sha:
+                conn.execute(
+                    "UPDATE deploys SET status = 'running', owner = ?, lease_until = ?, attempts = attempts + 1, "
+                    "replicas = ?, branch = ?, trigger = ?, error = NULL, error_stage = NULL, updated_at = ? "
+                    "WHERE id = ?",
+                    (owner, now + lease_seconds, replicas, branch, trigger, now, row['id'])
+                )
+                return dict(row), True
+
+            # Without a commit there is nothing to resume, but it is still
+            # another try at the same deploy, so it counts towards the retry limit
+            attempts = 1
+            if row and commit_sha is None and row['repo_url'] == repo_url:
+                attempts = row['attempts'] + 1
+
+            # Only resume work for the same source; anything else is stale
+            conn.execute(
+                "UPDATE deploys SET status = 'abandoned', owner = NULL, updated_at = ? "
+                "WHERE name = ? AND status IN ('running', 'failed')",
+                (now, name)
+            )
+            cursor = conn.execute(
+                "INSERT INTO deploys (name, repo_url, commit_sha, workspace, status, owner, lease_until, "
+                "replicas, branch, trigger, attempts, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'running', ?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, repo_url, commit_sha, workspace, owner, now + lease_seconds,
+                 replicas, branch, trigger, attempts, now, now)
+            )
+            return {'id': cursor.lastrowid, 'name': name, 'repo_url': repo_url,
+                    'commit_sha': commit_sha, 'workspace': workspace}, False
+
+    def renew(self, deploy_id, lease_seconds):
+        """Extend this process's lease on a running deploy. False if it was lost"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE deploys SET lease_until = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                (time.time() + lease_seconds, deploy_id, process_owner())
+            )
+            return cursor.rowcount == 1
+
+    def get(self, deploy_id):
+        """Return a deploy with its completed stages, or None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM deploys WHERE id = ?", (deploy_id,)).fetchone()
+            if not row:
+                return None
+            deploy = dict(row)
+            for field in ('result', 'timings'):
+                deploy[field] = json.loads(deploy[field]) if deploy[field] else None
+            deploy['stages'] = [r['stage'] for r in conn.execute(
+                "SELECT stage FROM stages WHERE deploy_id = ? ORDER BY completed_at",
+                (deploy_id,)
+            )]
+            return deploy
+
+    def find_orphans(self, max_attempts, retry_delay):
+        """Deploys whose worker died, plus failed ones still worth retrying"""
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM deploys d WHERE attempts < ? "
+                "AND ((status = 'running' AND lease_until < ?) OR (status = 'failed' AND updated_at < ?)) "
+                "AND id = (SELECT MAX(id) FROM deploys WHERE name = d.name)",
+                (max_attempts, now, now - retry_delay)
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+    def set_commit(self, deploy_id, commit_sha):
+        """Update the commit a deploy is building"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE deploys SET commit_sha = ?, updated_at = ? WHERE id = ?",
+                (commit_sha, time.time(), deploy_id)
+            )
+
+    def completed_stages(self, deploy_id):
+        """Return {stage: result} for every stage a deploy has finished"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT stage, result FROM stages WHERE deploy_id = ?",
+                (deploy_id,)
+            ).fetchall()
+            return {row['stage']: json.loads(row['result']) for row in rows}
+
+    def record_stage(self, deploy_id, stage, result):
+        """Persist the result of a finished stage"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO stages (deploy_id, stage, result, completed_at) VALUES (?, ?, ?, ?)",
+                (deploy_id, stage, json.dumps(result), now)
+            )
+            conn.execute(
+                "UPDATE deploys SET updated_at = ? WHERE id = ?",
+                (now, deploy_id)
+            )
+
+    def clear_stages(self, deploy_id, stages):
+        """Forget stages that have to run again"""
+        with self._connect() as conn:
+            conn.executemany(
+                "DELETE FROM stages WHERE deploy_id = ? AND stage = ?",
+                [(deploy_id, stage) for stage in stages]
+            )
+
+    def finish(self, deploy_id, status, result=None, error=None, error_stage=None, trace=None):
+        """Set the final status of a deploy this process owns (succeeded or failed).
+
+        Returns False if the deploy was abandoned or taken over in the meantime.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE deploys SET status = ?, owner = NULL, lease_until = 0, result = ?, error = ?, "
+                "error_stage = ?, trace_id = ?, timings = ?, updated_at = ? WHERE id = ? AND owner = ?",
+                (status, json.dumps(result) if result is not None else None, error, error_stage,
+                 trace.trace_id if trace else None, json.dumps(trace.timings()) if trace else None,
+                 time.time(), deploy_id, process_owner())
+            )
+            return cursor.rowcount == 1
+
+    def abandon(self, name):
+        """Mark every unfinished deploy of an app as abandoned and return them"""
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT * FROM deploys WHERE name = ? AND status IN ('running', 'failed')",
+                (name,)
+            ).fetchall()
+            conn.execute(
+                "UPDATE deploys SET status = 'abandoned', owner = NULL, lease_until = 0, updated_at = ? "
+                "WHERE name = ? AND status IN ('running', 'failed')",
+                (time.time(), name)
+            )
+            return [dict(row) for row in rows]
@@ -0,0 +1,368 @@
+import os
+import re
+import shutil
+import threading
+import time
+from app.config import Config
+from app.deploy_journal import DeployJournal
+from app.tracing import Trace, activate, span, set_trace_attributes
+
+try:
+    import fcntl
+except ImportError:  # Windows: the journal lease is the only cross-process guard
+    fcntl = None
+
+# Deployment names become Kubernetes object names and workspace directories
+NAME_PATTERN = re.compile(r'^[a-z0-9]([-a-z0-9]{0,61}[a-z0-9])?$')
+
+STAGES = ('clone', 'detect', 'build', 'push', 'apply', 'ready')
+
+# Stage names reported to the dashboard (see static/app.js)
+ERROR_STAGES = {
+    'clone': 'docker_build',
+    'detect': 'docker_build',
+    'build': 'docker_build',
+    'push': 'push',
+    'apply': 'k8s_deploy',
+    'ready': 'k8s_deploy',
+}
+
+class DeployPipeline:
+    """Clone -> detect -> build -> push -> apply -> ready, checkpointed per stage.
+
+    Every finished stage is written to the journal. A running deploy renews
+    its journal lease; if the worker dies the lease runs out and the sweeper
+    (or the next deploy of the same app and commit) picks up after the last
+    finished stage instead of starting over. Each app keeps its checkout
+    between deploys, so a redeploy only fetches new commits and Docker only
+    rebuilds the layers whose inputs changed.
+    """
+
+    def __init__(self, docker_builder, k8s_deployer, journal=None, on_finish=None):
+        self.docker_builder = docker_builder
+        self.k8s_deployer = k8s_deployer
+        self.journal = journal or DeployJournal()
+        # Called as on_finish(deploy, success, result) after every deploy
+        self.on_finish = on_finish
+        self.workspace_root = Config.DEPLOY_WORKSPACE_DIR
+        os.makedirs(self.workspace_root, exist_ok=True)
+        # Names being deployed by this process (the workspace lock and the
+        # journal lease cover other workers)
+        self._running = set()
+        self._running_lock = threading.Lock()
+        self._sweeper = None
+
+    def start(self, repo_url, name, replicas=2, tag='latest', branch=None, trigger='dashboard'):
+        """Claim a deploy and run it in a background thread.
+
+        Returns (deploy_id, None), or (None, error) if the app is already
+        being deployed. Poll the journal for the outcome.
+        """
+        claim, error = self._claim(repo_url, name, replicas, branch, trigger)
+        if not claim:
+            return None, error
+        threading.Thread(target=self._execute, args=(claim, tag), daemon=True).start()
+        return claim['id'], None
+
+    def run(self, repo_url, name, replicas=2, tag='latest', branch=None, trigger='dashboard'):
+        """Run (or resume) a deploy in this thread. Returns (success, result, error_stage)"""
+        claim, error = self._claim(repo_url, name, replicas, branch, trigger)
+        if not claim:
+            return False, error, 'conflict'
+        return self._execute(claim, tag)
+
+    def start_sweeper(self):
+        """Resume orphaned deploys in a background thread"""
+        if self._sweeper:
+            return
+        self._sweeper = threading.Thread(target=self._sweep_loop, daemon=True)
+        self._sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(Config.DEPLOY_SWEEP_INTERVAL)
+            try:
+                self.resume_orphans()
+            except Exception as e:
+                print(f"Deploy sweep error: {e}")
+
+    def resume_orphans(self):
+        """Restart deploys whose worker died and retry recent failures. Returns the deploy ids"""
+        started = []
+        for orphan in self.journal.find_orphans(Config.DEPLOY_MAX_ATTEMPTS, Config.DEPLOY_RETRY_DELAY):
+            if not is_valid_name(orphan['name']):
+                # Journaled before names were validated; never touch its path
+                self.journal.abandon(orphan['name'])
+                continue
+            deploy_id, _ = self.start(
+                orphan['repo_url'],
+                orphan['name'],
+                replicas=orphan['replicas'],
+                branch=orphan['branch'],
+                trigger='resume'
+            )
+            if deploy_id:
+                print(f"Resuming orphaned deploy of {orphan['name']} as {deploy_id}")
+                started.append(deploy_id)
+        return started
+
+    def _claim(self, repo_url, name, replicas, branch, trigger):
+        """Take the workspace lock and the journal lease for a deploy"""
+        workspace = self._workspace(name)
+        conflict = f"A deploy of {name} is already in progress"
+        with self._running_lock:
+            if name in self._running:
+                return None, conflict
+            self._running.add(name)
+
+        # The trace starts here so the ls-remote round trip is part of it;
+        # _execute continues it on the deploy thread
+        trace = Trace('deploy', {'trigger': trigger, 'repo': repo_url, 'deployment': name, 'branch': branch})
+        lock = deploy = None
+        try:
+            lock = self._lock_workspace(name)
+            if lock is not None:
+                with activate(trace, finish=False), span('claim'):
+                    commit = self.docker_builder.get_remote_head(repo_url, branch)
+                    deploy, resumed = self.journal.acquire(
+                        name, repo_url, commit, workspace,
+                        replicas, branch, trigger, Config.DEPLOY_LEASE_SECONDS
+                    )
+        finally:
+            if deploy is None:
+                self._release(name, lock)
+        if deploy is None:
+            return None, conflict
+
+        if resumed:
+            print(f"Resuming deploy {deploy['id']} of {name}")
+        return {
+            'id': deploy['id'],
+            'commit_sha': deploy['commit_sha'],
+            'lock': lock,
+            'lost': threading.Event(),
+            'trace': trace,
+            'context': {
+                'repo_url': repo_url,
+                'name': name,
+                'replicas': replicas,
+                'branch': branch,
+                'trigger': trigger,
+                'workspace': workspace,
+            },
+        }, None
+
+    def _release(self, name, lock):
+        if lock is not None:
+            lock.close()
+        with self._running_lock:
+            self._running.discard(name)
+
+    def _lock_workspace(self, name):
+        """Lock an app's workspace against other processes; None if it is held"""
+        handle = open(f"{self._workspace(name)}.lock", 'a')
+        if fcntl is None:
+            return handle
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return None
+        return handle
+
+    def _heartbeat(self, claim, stop):
+        """Renew the journal lease until the deploy ends"""
+        interval = Config.DEPLOY_LEASE_SECONDS / 3
+        while not stop.wait(interval):
+            try:
+                if not self.journal.renew(claim['id'], Config.DEPLOY_LEASE_SECONDS):
+                    claim['lost'].set()
+                    return
+            except Exception as e:
+                print(f"Error renewing deploy lease: {e}")
+
+    def _execute(self, claim, tag):
+        """Run a claimed deploy, record the outcome and release the claim"""
+        deploy_id, context = claim['id'], claim['context']
+        context['tag'] = tag
+        stop = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(claim, stop), daemon=True).start()
+
+        trace = claim['trace']
+        try:
+            with activate(trace):
+                success, result, stage = self._run(claim)
+        except Exception as e:
+            print(f"Deploy {deploy_id} of {context['name']} crashed: {e}")
+            success, result, stage = False, str(e), None
+        finally:
+            stop.set()
+            self._release(context['name'], claim['lock'])
+
+        if success:
+            recorded = self.journal.finish(deploy_id, 'succeeded', result=result, trace=trace)
+        else:
+            recorded = self.journal.finish(deploy_id, 'failed', error=result, error_stage=stage, trace=trace)
+        if not recorded:
+            # Abandoned (the app was deleted) or taken over by another worker
+            return False, f"Deploy {deploy_id} of {context['name']} was abandoned", 'conflict'
+
+        if self.on_finish:
+            try:
+                self.on_finish(dict(context, id=deploy_id), success, result)
+            except Exception as e:
+                print(f"Error in deploy callback: {e}")
+        return success, result, stage
+
+    def _run(self, claim):
+        deploy_id, context = claim['id'], claim['context']
+        set_trace_attributes(deploy_id=deploy_id, commit=claim['commit_sha'])
+
+        results = self.journal.completed_stages(deploy_id)
+        resumed = []
+        rerun = False
+
+        for stage in STAGES:
+            if claim['lost'].is_set():
+                return False, "Deploy was abandoned", ERROR_STAGES[stage]
+
+            if not rerun and stage in results and self._is_current(stage, results, context):
+                resumed.append(stage)
+                with span(f'stage {stage}', resumed=True):
+                    pass
+                continue
+
+            # Everything after a re-run stage depends on its output
+            rerun = True
+            later = STAGES[STAGES.index(stage):]
+            self.journal.clear_stages(deploy_id, later)
+            for later_stage in later:
+                results.pop(later_stage, None)
+
+            with span(f'stage {stage}') as current:
+                success, result = getattr(self, f'_run_{stage}')(context, results)
+                if not success and current is not None:
+                    current.error = result
+            if not success:
+                return False, result, ERROR_STAGES[stage]
+
+            self.journal.record_stage(deploy_id, stage, result)
+            results[stage] = result
+            if stage == 'clone':
+                set_trace_attributes(commit=result['commit'])
+                if result['commit'] != claim['commit_sha']:
+                    self.journal.set_commit(deploy_id, result['commit'])
+
+        # The workspace is kept as the build cache for the next redeploy
+        return True, {
+            'image': results['build']['image'],
+            'image_size': results['build'].get('size'),
+            'port': results['detect']['port'],
+            'commit': results['clone']['commit'],
+            'branch': results['clone'].get('branch'),
+            'resumed_stages': resumed,
+        }, None
+
+    def forget(self, name):
+        """Abandon unfinished deploys of an app and remove its workspace"""
+        self.journal.abandon(name)
+        # A deploy still running elsewhere notices on its next heartbeat;
+        # leave its checkout alone until then
+        lock = self._lock_workspace(name)
+        if lock is None:
+            return
+        try:
+            shutil.rmtree(self._workspace(name), ignore_errors=True)
+        finally:
+            lock.close()
+
+    def _workspace(self, name):
+        """Return an app's checkout directory, refusing names that leave workspace_root"""
+        if not is_valid_name(name):
+            raise ValueError(f"Invalid deployment name: {name!r}")
+        root = os.path.realpath(self.workspace_root)
+        workspace = os.path.realpath(os.path.join(root, name))
+        if os.path.dirname(workspace) != root:
+            raise ValueError(f"Invalid deployment name: {name!r}")
+        return workspace
+
+    def _is_current(self, stage, results, context):
+        """Check that a journaled stage result is still valid"""
+        if stage == 'clone':
+            # The checkout is only needed again if the image has to be rebuilt
+            checkout = self.docker_builder.get_local_head(context['workspace'])
+            return (checkout == results['clone']['commit']
+                    or ('build' in results and self._is_current('build', results, context)))
+        if stage == 'build':
+            image = results['build']['image']
+            return self.docker_builder.get_image_id(image) == results['build']['digest']
+        return True
+
+    def _run_clone(self, context, results):
+        workspace = context['workspace']
+        repo_url, branch = context['repo_url'], context['branch']
+
+        # Incremental: fetch into the existing checkout, fall back to a fresh clone
+        updated = (os.path.isdir(os.path.join(workspace, '.git'))
+                   and self.docker_builder.update_repository(repo_url, workspace, branch))
+        if not updated:
+            shutil.rmtree(workspace, ignore_errors=True)
+            if not self.docker_builder.clone_repository(repo_url, workspace, branch):
+                return False, "Failed to clone repository"
+
+        return True, {
+            'workspace': workspace,
+            'commit': self.docker_builder.get_local_head(workspace),
+            'branch': branch or self.docker_builder.get_local_branch(workspace),
+        }
+
+    def _run_detect(self, context, results):
+        workspace = context['workspace']
+        project_type, port = self.docker_builder.detect_project_type(workspace)
+        if not self.docker_builder.create_dockerfile(workspace):
+            return False, "Failed to create Dockerfile"
+        return True, {'project_type': project_type, 'port': port}
+
+    def _run_build(self, context, results):
+        image = self.docker_builder.build_image(context['workspace'], context['name'], context['tag'])
+        if not image:
+            return False, "Failed to build Docker image"
+        return True, {
+            'image': image,
+            'digest': self.docker_builder.get_image_id(image),
+            'size': self.docker_builder.get_image_size(image),
+        }
+
+    def _run_push(self, context, results):
+        if not self.docker_builder.login_dockerhub():
+            return False, "Failed to login to Docker Hub"
+        image = results['build']['image']
+        if not self.docker_builder.push_image(image):
+            return False, "Failed to push image to Docker Hub"
+        return True, {'image': image}
+
+    def _run_apply(self, context, results):
+        success, message = self.k8s_deployer.deploy_application(
+            name=context['name'],
+            image=results['build']['image'],
+            port=results['detect']['port'],
+            replicas=context['replicas'],
+            revision=results['clone']['commit']
+        )
+        if not success:
+            return False, message
+        return True, {'message': message}
+
+    def _run_ready(self, context, results):
+        success, message = self.k8s_deployer.wait_for_ready(
+            context['name'],
+            timeout=Config.DEPLOY_READY_TIMEOUT
+        )
+        if not success:
+            return False, message
+        return True, {'message': message}
+
+
+def is_valid_name(name):
+    """Check a deployment name is a DNS-1123 label (safe for Kubernetes and as a path)"""
+    return bool(name) and NAME_PATTERN.match(name) is not None
@@ -1,24 +1,119 @@
 import os
+import json
 import subprocess
-import tempfile
-import shutil
-from git import Repo
+from git import Repo, Git
 from app.config import Config
+from app.tracing import span
+
+# Files that never belong in a generated image
+DOCKERIGNORE_COMMON = [
+    '.git',
+    '.gitignore',
+    '.github',
+    '.dockerignore',
+    'Dockerfile',
+    '.vscode',
+    '.idea',
+    '.DS_Store',
+    'tests',
+    '**/__tests__',
+    'coverage',
+    '*.log',
+]
+
+DOCKERIGNORE_BY_TYPE = {
+    'python': ['__pycache__', '**/__pycache__', '*.pyc', '.venv', 'venv', 'env', '.pytest_cache', '.mypy_cache', '.tox'],
+    'nodejs': ['node_modules', 'npm-debug.log*', '.npm', '.next/cache'],
+    'go': ['vendor'],
+    'static': ['node_modules'],
+}
 
 class DockerBuilder:
     def __init__(self):
         self.dockerhub_username = Config.DOCKERHUB_USERNAME
         self.dockerhub_password = Config.DOCKERHUB_PASSWORD
     
-    def clone_repository(self, repo_url, temp_dir):
+    def _run_docker(self, args, **kwargs):
+        """Run a docker CLI command inside a tracing span"""
+        command = ' '.join(args[:3] if args[1] == 'image' else args[:2])
+        with span(command) as current:
+            result = subprocess.run(args, **kwargs)
+            if current is not None:
+                current.attributes['exit_code'] = result.returncode
+                if result.returncode != 0:
+                    current.error = (result.stderr or '').strip()[-500:] or f"exit code {result.returncode}"
+            return result
+    
+    def clone_repository(self, repo_url, temp_dir, branch=None):
         """Clone GitHub repository to temporary directory"""
         try:
-            Repo.clone_from(repo_url, temp_dir)
+            with span('git clone', branch=branch or ''):
+                if branch:
+                    Repo.clone_from(repo_url, temp_dir, branch=branch)
+                else:
+                    Repo.clone_from(repo_url, temp_dir)
             return True
         except Exception as e:
             print(f"Error cloning repository: {e}")
             return False
     
+    def update_repository(self, repo_url, repo_dir, branch=None):
+        """Bring an existing clone up to date with the remote branch (or HEAD)"""
+        try:
+            repo = Repo(repo_dir)
+            repo.remotes.origin.set_url(repo_url)
+            with span('git fetch', branch=branch or ''):
+                repo.git.fetch('origin', branch or 'HEAD')
+            repo.git.reset('--hard', 'FETCH_HEAD')
+            # Drop generated Dockerfiles and build leftovers from the last deploy
+            repo.git.clean('-fdx')
+            return True
+        except Exception as e:
+            print(f"Error updating repository: {e}")
+            return False
+    
+    def get_remote_head(self, repo_url, branch=None):
+        """Return the commit SHA of the remote branch (or HEAD), or None"""
+        try:
+            ref = f'refs/heads/{branch}' if branch else 'HEAD'
+            with span('git ls-remote', ref=ref):
+                output = Git().ls_remote(repo_url, ref)
+            return output.split()[0] if output else None
+        except Exception as e:
+            print(f"Error reading remote HEAD: {e}")
+            return None
+    
+    def get_local_branch(self, repo_dir):
+        """Return the branch checked out in a cloned repository, or None"""
+        try:
+            return Repo(repo_dir).active_branch.name
+        except Exception:
+            return None
+    
+    def get_local_head(self, repo_dir):
+        """Return the commit SHA checked out in a cloned repository, or None"""
+        try:
+            return Repo(repo_dir).head.commit.hexsha
+        except Exception:
+            return None
+    
+    def get_image_id(self, full_image_name):
+        """Return the local image ID (content digest) for an image, or None"""
+        try:
+            result = self._run_docker(
+                ['docker', 'image', 'inspect', '--format', '{{.Id}}', full_image_name],
+                capture_output=True,
+                text=True,
+                encoding='utf-8',
+                errors='replace'
+            )
+            if result.returncode == 0:
+                return result.stdout.strip()
+            return None
+        except Exception as e:
+            print(f"Error inspecting image: {e}")
+            return None
+    
     def detect_project_type(self, temp_dir):
         """Detect what type of project this is and return (type, port)"""
         files = os.listdir(temp_dir)
@@ -52,7 +147,6 @@ class DockerBuilder:
         
         # Auto-detect project type
         project_type, port = self.detect_project_type(temp_dir)
-        self.last_detected_port = port  # Store for later use
         print(f"Detected project type: {project_type} (port: {port})")
         
         if project_type == 'static':
@@ -67,15 +161,48 @@ CMD ["nginx", "-g", "daemon off;"]
 """
         
         elif project_type == 'nodejs':
-            # Node.js app
-            dockerfile_content = """FROM node:18-alpine
+            # Node.js app: dependencies are installed in their own stage so the
+            # runtime image only carries production node_modules
+            has_lockfile = os.path.exists(os.path.join(temp_dir, 'package-lock.json'))
+            install = 'npm ci' if has_lockfile else 'npm install'
+            
+            if self._has_npm_script(temp_dir, 'build'):
+                # Build needs devDependencies; prune them once the build is done
+                dockerfile_content = f"""FROM node:18-alpine AS builder
+
+WORKDIR /app
+
+COPY package*.json ./
+RUN {install}
+
+COPY . .
+RUN npm run build && npm prune --omit=dev
+
+FROM node:18-alpine
+
+WORKDIR /app
+ENV NODE_ENV=production
+
+COPY --from=builder /app ./
+
+EXPOSE 3000
+
+CMD ["npm", "start"]
+"""
+            else:
+                dockerfile_content = f"""FROM node:18-alpine AS deps
 
 WORKDIR /app
 
 COPY package*.json ./
+RUN {install} --omit=dev && npm cache clean --force
+
+FROM node:18-alpine
 
-RUN npm install
+WORKDIR /app
+ENV NODE_ENV=production
 
+COPY --from=deps /app/node_modules ./node_modules
 COPY . .
 
 EXPOSE 3000
@@ -124,13 +251,25 @@ CMD ["./main"]
             
             # Python Dockerfile
             if has_requirements:
-                dockerfile_content = f"""FROM python:3.9-slim
+                # Wheels are built on the full image (compilers available) and
+                # installed into a venv that is copied into the slim runtime
+                dockerfile_content = f"""FROM python:3.9 AS builder
 
-WORKDIR /app
+WORKDIR /build
 
 COPY requirements.txt .
-RUN pip install --no-cache-dir -r requirements.txt
+RUN pip wheel --no-cache-dir --wheel-dir /wheels -r requirements.txt \\
+    && python -m venv /opt/venv \\
+    && /opt/venv/bin/pip install --no-cache-dir --no-index --find-links=/wheels -r requirements.txt
+
+FROM python:3.9-slim
+
+WORKDIR /app
+ENV PATH="/opt/venv/bin:$PATH" \\
+    PYTHONDONTWRITEBYTECODE=1 \\
+    PYTHONUNBUFFERED=1
 
+COPY --from=builder /opt/venv /opt/venv
 COPY . .
 
 EXPOSE 8000
@@ -153,18 +292,66 @@ CMD ["python", "{main_file}"]
             with open(dockerfile_path, 'w') as f:
                 f.write(dockerfile_content.strip())
             print(f"Created Dockerfile for {project_type} project")
+            self.create_dockerignore(temp_dir, project_type)
             return True
         except Exception as e:
             print(f"Error creating Dockerfile: {e}")
             return False
     
+    def _has_npm_script(self, temp_dir, script):
+        """Check whether package.json defines an npm script"""
+        try:
+            with open(os.path.join(temp_dir, 'package.json'), encoding='utf-8') as f:
+                return script in (json.load(f).get('scripts') or {})
+        except Exception:
+            return False
+    
+    def create_dockerignore(self, temp_dir, project_type):
+        """Create a .dockerignore if one doesn't exist, keeping the build context small"""
+        dockerignore_path = os.path.join(temp_dir, '.dockerignore')
+        
+        if os.path.exists(dockerignore_path):
+            print("Found existing .dockerignore")
+            return True
+        
+        entries = DOCKERIGNORE_COMMON + DOCKERIGNORE_BY_TYPE.get(project_type, [])
+        try:
+            with open(dockerignore_path, 'w') as f:
+                f.write('\n'.join(entries) + '\n')
+            print(f"Created .dockerignore for {project_type} project")
+            return True
+        except Exception as e:
+            print(f"Error creating .dockerignore: {e}")
+            return False
+    
+    def get_image_size(self, full_image_name):
+        """Return the size of a local image in bytes, or None"""
+        try:
+            result = self._run_docker(
+                ['docker', 'image', 'inspect', '--format', '{{.Size}}', full_image_name],
+                capture_output=True,
+                text=True,
+                encoding='utf-8',
+                errors='replace'
+            )
+            if result.returncode == 0:
+                return int(result.stdout.strip())
+            return None
+        except Exception as e:
+            print(f"Error inspecting image size: {e}")
+            return None
+    
     def build_image(self, temp_dir, image_name, tag='latest'):
         """Build Docker image"""
         try:
             full_image_name = f"{self.dockerhub_username}/{image_name}:{tag}"
             
-            result = subprocess.run(
-                ['docker', 'build', '-t', full_image_name, '.'],
+            # Reuse layers from the last pushed image when the local cache is cold
+            result = self._run_docker(
+                ['docker', 'build',
+                 '--build-arg', 'BUILDKIT_INLINE_CACHE=1',
+                 '--cache-from', full_image_name,
+                 '-t', full_image_name, '.'],
                 cwd=temp_dir,
                 capture_output=True,
                 text=True,
@@ -173,7 +360,11 @@ CMD ["python", "{main_file}"]
             )
             
             if result.returncode == 0:
-                print(f"Successfully built image: {full_image_name}")
+                size = self.get_image_size(full_image_name)
+                if size is not None:
+                    print(f"Successfully built image: {full_image_name} ({size / (1024 * 1024):.1f} MB)")
+                else:
+                    print(f"Successfully built image: {full_image_name}")
                 return full_image_name
             else:
                 print(f"Error building image: {result.stderr}")
@@ -185,7 +376,7 @@ CMD ["python", "{main_file}"]
     def login_dockerhub(self):
         """Login to Docker Hub"""
         try:
-            result = subprocess.run(
+            result = self._run_docker(
                 ['docker', 'login', '-u', self.dockerhub_username, '-p', self.dockerhub_password],
                 capture_output=True,
                 text=True,
@@ -200,7 +391,7 @@ CMD ["python", "{main_file}"]
     def push_image(self, image_name):
         """Push Docker image to Docker Hub"""
         try:
-            result = subprocess.run(
+            result = self._run_docker(
                 ['docker', 'push', image_name],
                 capture_output=True,
                 text=True,
@@ -217,34 +408,3 @@ CMD ["python", "{main_file}"]
         except Exception as e:
             print(f"Error pushing image: {e}")
             return False
-    
-    def build_and_push(self, repo_url, image_name, tag='latest'):
-        """Complete workflow: clone, build, and push"""
-        temp_dir = tempfile.mkdtemp()
-        
-        try:
-            # Clone repository
-            if not self.clone_repository(repo_url, temp_dir):
-                return False, "Failed to clone repository"
-            
-            # Create Dockerfile if needed
-            self.create_dockerfile(temp_dir)
-            
-            # Build image
-            full_image_name = self.build_image(temp_dir, image_name, tag)
-            if not full_image_name:
-                return False, "Failed to build Docker image"
-            
-            # Login to Docker Hub
-            if not self.login_dockerhub():
-                return False, "Failed to login to Docker Hub"
-            
-            # Push image
-            if not self.push_image(full_image_name):
-                return False, "Failed to push image to Docker Hub"
-            
-            return True, full_image_name
-        
-        finally:
-            # Cleanup
-            shutil.rmtree(temp_dir, ignore_errors=True)
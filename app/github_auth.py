@@ -1,6 +1,7 @@
 import requests
 from flask import session, redirect, url_for, request
 from app.config import Config
+from app.tracing import span
 
 class GitHubAuth:
     AUTHORIZE_URL = 'https://github.com/login/oauth/authorize'
@@ -28,7 +29,9 @@ class GitHubAuth:
         }
         headers = {'Accept': 'application/json'}
         
-        response = requests.post(GitHubAuth.TOKEN_URL, data=data, headers=headers)
+        with span('github POST /login/oauth/access_token') as current:
+            response = requests.post(GitHubAuth.TOKEN_URL, data=data, headers=headers)
+            _record_status(current, response)
         if response.status_code == 200:
             return response.json().get('access_token')
         return None
@@ -40,7 +43,9 @@ class GitHubAuth:
             'Authorization': f'token {access_token}',
             'Accept': 'application/json'
         }
-        response = requests.get(f"{GitHubAuth.API_URL}/user", headers=headers)
+        with span('github GET /user') as current:
+            response = requests.get(f"{GitHubAuth.API_URL}/user", headers=headers)
+            _record_status(current, response)
         if response.status_code == 200:
             return response.json()
         return None
@@ -56,11 +61,13 @@ class GitHubAuth:
         page = 1
         
         while True:
-            response = requests.get(
-                f"{GitHubAuth.API_URL}/user/repos",
-                headers=headers,
-                params={'page': page, 'per_page': 100, 'sort': 'updated'}
-            )
+            with span('github GET /user/repos', page=page) as current:
+                response = requests.get(
+                    f"{GitHubAuth.API_URL}/user/repos",
+                    headers=headers,
+                    params={'page': page, 'per_page': 100, 'sort': 'updated'}
+                )
+                _record_status(current, response)
             if response.status_code != 200:
                 break
             
@@ -83,10 +90,21 @@ class GitHubAuth:
             'Authorization': f'token {access_token}',
             'Accept': 'application/json'
         }
-        response = requests.get(
-            f"{GitHubAuth.API_URL}/repos/{owner}/{repo}",
-            headers=headers
-        )
+        with span('github GET /repos/{owner}/{repo}', owner=owner, repo=repo) as current:
+            response = requests.get(
+                f"{GitHubAuth.API_URL}/repos/{owner}/{repo}",
+                headers=headers
+            )
+            _record_status(current, response)
         if response.status_code == 200:
             return response.json()
         return None
+
+
+def _record_status(current, response):
+    """Attach the HTTP status of a GitHub call to its tracing span"""
+    if current is None:
+        return
+    current.attributes['http.status_code'] = response.status_code
+    if response.status_code >= 400:
+        current.error = f"HTTP {response.status_code}"
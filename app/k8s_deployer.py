@@ -1,16 +1,57 @@
 from kubernetes import client, config
 from kubernetes.client.rest import ApiException
 from app.config import Config
+from app.tracing import span
+import heapq
+import math
+import queue
+import threading
+import time
 import yaml
 
+# Marks deployments created by this platform (the only ones scaled to zero)
+MANAGED_LABEL = "app.kubernetes.io/managed-by"
+MANAGED_BY = "localkubelab"
+# Sleeping deployments remember how many replicas to restore on wake-up
+STATE_ANNOTATION = "localkubelab/state"
+REPLICAS_ANNOTATION = "localkubelab/replicas"
+# Changing this pod template annotation rolls out new pods for a reused image tag
+REVISION_ANNOTATION = "localkubelab/revision"
+
+LOG_CHUNK_SIZE = 8192
+LOG_QUEUE_SIZE = 1000
+# Seconds of overlap when switching from the log backlog to following
+LOG_FOLLOW_OVERLAP = 5
+
+class _TracedApi:
+    """Wraps a Kubernetes API client so every call is timed as a tracing span"""
+    
+    def __init__(self, api):
+        self._api = api
+    
+    def __getattr__(self, attr):
+        method = getattr(self._api, attr)
+        if not callable(method):
+            return method
+        
+        def traced(*args, **kwargs):
+            with span(f"k8s {attr}", resource=kwargs.get('name', '')) as current:
+                try:
+                    return method(*args, **kwargs)
+                except ApiException as e:
+                    if current is not None:
+                        current.attributes['http.status_code'] = e.status
+                    raise
+        return traced
+
 class KubernetesDeployer:
     def __init__(self):
         self.configured = False
         try:
             # Try to load from default kubeconfig
             config.load_kube_config()
-            self.apps_v1 = client.AppsV1Api()
-            self.core_v1 = client.CoreV1Api()
+            self.apps_v1 = _TracedApi(client.AppsV1Api())
+            self.core_v1 = _TracedApi(client.CoreV1Api())
             self.namespace = Config.K8S_NAMESPACE
             self.configured = True
             print("✅ Kubernetes configured successfully")
@@ -19,7 +60,7 @@ class KubernetesDeployer:
             print("   The app will run, but deployments will fail.")
             print("   See SETUP_GUIDE.md to enable Kubernetes.")
     
-    def create_deployment(self, name, image, port=8080, replicas=2):
+    def create_deployment(self, name, image, port=8080, replicas=2, revision=None):
         """Create Kubernetes deployment"""
         
         if not self.configured:
@@ -28,7 +69,7 @@ class KubernetesDeployer:
         deployment = client.V1Deployment(
             api_version="apps/v1",
             kind="Deployment",
-            metadata=client.V1ObjectMeta(name=name),
+            metadata=client.V1ObjectMeta(name=name, labels={MANAGED_LABEL: MANAGED_BY}),
             spec=client.V1DeploymentSpec(
                 replicas=replicas,
                 selector=client.V1LabelSelector(
@@ -36,7 +77,8 @@ class KubernetesDeployer:
                 ),
                 template=client.V1PodTemplateSpec(
                     metadata=client.V1ObjectMeta(
-                        labels={"app": name}
+                        labels={"app": name},
+                        annotations={REVISION_ANNOTATION: revision} if revision else None
                     ),
                     spec=client.V1PodSpec(
                         containers=[
@@ -65,11 +107,11 @@ class KubernetesDeployer:
         except ApiException as e:
             if e.status == 409:
                 # Deployment already exists, update it
-                return self.update_deployment(name, image, port, replicas)
+                return self.update_deployment(name, image, port, replicas, revision)
             print(f"Error creating deployment: {e}")
             return False, str(e)
     
-    def update_deployment(self, name, image, port=8080, replicas=2):
+    def update_deployment(self, name, image, port=8080, replicas=2, revision=None):
         """Update existing Kubernetes deployment"""
         if not self.configured:
             return False, "Kubernetes is not configured."
@@ -80,6 +122,10 @@ class KubernetesDeployer:
             )
             
             deployment.spec.template.spec.containers[0].image = image
+            deployment.metadata.labels = {**(deployment.metadata.labels or {}), MANAGED_LABEL: MANAGED_BY}
+            if revision:
+                template_meta = deployment.spec.template.metadata
+                template_meta.annotations = {**(template_meta.annotations or {}), REVISION_ANNOTATION: revision}
             
             api_response = self.apps_v1.patch_namespaced_deployment(
                 name=name,
@@ -127,10 +173,10 @@ class KubernetesDeployer:
             print(f"Error creating service: {e}")
             return False, str(e)
     
-    def deploy_application(self, name, image, port=8080, replicas=2):
+    def deploy_application(self, name, image, port=8080, replicas=2, revision=None):
         """Complete deployment workflow"""
         # Create deployment
-        success, message = self.create_deployment(name, image, port, replicas)
+        success, message = self.create_deployment(name, image, port, replicas, revision)
         if not success:
             return False, f"Deployment failed: {message}"
         
@@ -160,6 +206,148 @@ class KubernetesDeployer:
             print(f"Error getting deployment status: {e}")
             return None
     
+    def wait_for_ready(self, name, timeout=60, interval=2, min_available=None):
+        """Wait until the latest rollout of a deployment is fully available
+        (or has at least min_available replicas, if given)"""
+        if not self.configured:
+            return False, "Kubernetes is not configured."
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                deployment = self.apps_v1.read_namespaced_deployment(
+                    name=name,
+                    namespace=self.namespace
+                )
+                status = deployment.status
+                wanted = deployment.spec.replicas or 0
+                if min_available is not None:
+                    wanted = min(wanted, min_available)
+                if ((status.observed_generation or 0) >= deployment.metadata.generation
+                        and (status.updated_replicas or 0) >= wanted
+                        and (status.available_replicas or 0) >= wanted):
+                    return True, f"{name} is ready"
+            except ApiException as e:
+                print(f"Error waiting for deployment: {e}")
+                return False, str(e)
+            if time.monotonic() >= deadline:
+                return False, f"Timed out after {timeout}s waiting for {name} to become ready"
+            time.sleep(interval)
+    
+    def is_sleeping(self, deployment):
+        """Check whether a deployment has been scaled to zero for idleness"""
+        annotations = deployment.metadata.annotations or {}
+        return annotations.get(STATE_ANNOTATION) == 'sleeping' and not deployment.spec.replicas
+    
+    def is_managed(self, name):
+        """Check whether a deployment exists and was created by this platform"""
+        if not self.configured:
+            return False
+        try:
+            deployment = self.apps_v1.read_namespaced_deployment(
+                name=name,
+                namespace=self.namespace
+            )
+        except ApiException as e:
+            if e.status != 404:
+                print(f"Error reading deployment: {e}")
+            return False
+        return (deployment.metadata.labels or {}).get(MANAGED_LABEL) == MANAGED_BY
+    
+    def list_managed_deployments(self):
+        """List deployments created by this platform"""
+        if not self.configured:
+            return []
+        try:
+            return self.apps_v1.list_namespaced_deployment(
+                namespace=self.namespace,
+                label_selector=f"{MANAGED_LABEL}={MANAGED_BY}"
+            ).items
+        except ApiException as e:
+            print(f"Error listing managed deployments: {e}")
+            return []
+    
+    def sleep_deployment(self, name):
+        """Scale a deployment to zero, remembering its replica count"""
+        if not self.configured:
+            return False, "Kubernetes is not configured."
+        try:
+            deployment = self.apps_v1.read_namespaced_deployment(
+                name=name,
+                namespace=self.namespace
+            )
+            if self.is_sleeping(deployment):
+                return True, f"{name} is already sleeping"
+            
+            self.apps_v1.patch_namespaced_deployment(
+                name=name,
+                namespace=self.namespace,
+                body={
+                    'metadata': {'annotations': {
+                        STATE_ANNOTATION: 'sleeping',
+                        REPLICAS_ANNOTATION: str(deployment.spec.replicas or 1)
+                    }},
+                    'spec': {'replicas': 0}
+                }
+            )
+            print(f"Deployment scaled to zero: {name}")
+            return True, f"{name} is sleeping"
+        except ApiException as e:
+            print(f"Error scaling deployment to zero: {e}")
+            return False, str(e)
+    
+    def wake_deployment(self, name):
+        """Restore a sleeping deployment to its previous replica count"""
+        if not self.configured:
+            return False, "Kubernetes is not configured."
+        try:
+            deployment = self.apps_v1.read_namespaced_deployment(
+                name=name,
+                namespace=self.namespace
+            )
+            if (deployment.metadata.labels or {}).get(MANAGED_LABEL) != MANAGED_BY:
+                return False, f"{name} is not managed by this platform"
+            if not self.is_sleeping(deployment):
+                return True, f"{name} is awake"
+            
+            annotations = deployment.metadata.annotations or {}
+            try:
+                replicas = max(1, int(annotations.get(REPLICAS_ANNOTATION, 1)))
+            except ValueError:
+                replicas = 1
+            
+            self.apps_v1.patch_namespaced_deployment(
+                name=name,
+                namespace=self.namespace,
+                body={
+                    'metadata': {'annotations': {STATE_ANNOTATION: 'awake'}},
+                    'spec': {'replicas': replicas}
+                }
+            )
+            print(f"Deployment woken up: {name} ({replicas} replicas)")
+            return True, f"{name} is waking up"
+        except ApiException as e:
+            print(f"Error waking deployment: {e}")
+            return False, str(e)
+    
+    def get_service_port(self, name):
+        """Return the port a deployment's service is reachable on from this host, or None"""
+        if not self.configured:
+            return None
+        try:
+            service = self.core_v1.read_namespaced_service(
+                name=name,
+                namespace=self.namespace
+            )
+            if not service.spec.ports:
+                return None
+            # Same rule as list_deployments: NodePort services are reached on the node port
+            if service.spec.type == 'NodePort':
+                return service.spec.ports[0].node_port
+            return service.spec.ports[0].port
+        except ApiException as e:
+            print(f"Error reading service: {e}")
+            return None
+    
     def list_deployments(self):
         """List all deployments in namespace"""
         if not self.configured:
@@ -190,7 +378,8 @@ class KubernetesDeployer:
                     'replicas': d.spec.replicas,
                     'available_replicas': d.status.available_replicas or 0,
                     'image': d.spec.template.spec.containers[0].image,
-                    'port': port
+                    'port': port,
+                    'state': 'sleeping' if self.is_sleeping(d) else 'awake'
                 })
             
             return result
@@ -219,3 +408,169 @@ class KubernetesDeployer:
         except ApiException as e:
             print(f"Error deleting resources: {e}")
             return False, str(e)
+
+    def list_pods(self, name):
+        """List pod names belonging to a deployment"""
+        if not self.configured:
+            return []
+        try:
+            pods = self.core_v1.list_namespaced_pod(
+                namespace=self.namespace,
+                label_selector=f"app={name}"
+            )
+            return [p.metadata.name for p in pods.items]
+        except ApiException as e:
+            print(f"Error listing pods: {e}")
+            return []
+    
+    def _open_pod_log(self, pod, since_seconds=None, tail_lines=None, follow=False):
+        """Open a raw (unbuffered) log stream for a single pod"""
+        kwargs = {'timestamps': True, 'follow': follow}
+        if since_seconds is not None:
+            kwargs['since_seconds'] = since_seconds
+        if tail_lines is not None:
+            kwargs['tail_lines'] = tail_lines
+        return self.core_v1.read_namespaced_pod_log(
+            name=pod,
+            namespace=self.namespace,
+            _preload_content=False,
+            **kwargs
+        )
+    
+    @staticmethod
+    def _iter_log_lines(response, pod):
+        """Yield (sort_key, line, pod) from a raw log response, one chunk at a time"""
+        pending = b''
+        try:
+            for chunk in response.stream(LOG_CHUNK_SIZE):
+                pending += chunk
+                *lines, pending = pending.split(b'\n')
+                for line in lines:
+                    text = line.decode('utf-8', errors='replace')
+                    yield _log_sort_key(text), f"[{pod}] {text}\n", pod
+            if pending:
+                text = pending.decode('utf-8', errors='replace')
+                yield _log_sort_key(text), f"[{pod}] {text}\n", pod
+        finally:
+            response.release_conn()
+    
+    def stream_logs(self, name, since_seconds=None, tail_lines=None, follow=False, max_follow_seconds=None):
+        """Stream logs of every replica of a deployment, merged by timestamp.
+        
+        The pod log streams are opened before this returns, so API errors
+        surface here rather than halfway through a response. Returns None if
+        the deployment has no pods, otherwise a generator of lines. Lines are
+        read from the API server in fixed-size chunks, so memory use does not
+        depend on the size of the log.
+        
+        With follow=True the existing backlog is merged by timestamp first;
+        new lines are then emitted as they arrive until max_follow_seconds.
+        """
+        pods = self.list_pods(name)
+        if not pods:
+            return None
+        
+        started = time.time()
+        responses = []
+        try:
+            for pod in pods:
+                responses.append((pod, self._open_pod_log(pod, since_seconds, tail_lines)))
+        except ApiException:
+            for _, response in responses:
+                response.release_conn()
+            raise
+        
+        def generate():
+            last_seen = {}
+            # Each pod's log is already in timestamp order, so a k-way merge
+            # only ever holds one pending line per pod
+            streams = [self._iter_log_lines(r, pod) for pod, r in responses]
+            for key, line, pod in heapq.merge(*streams, key=lambda item: item[0]):
+                last_seen[pod] = key
+                yield line
+            
+            if follow:
+                yield from self._follow_logs(pods, started, last_seen, max_follow_seconds)
+        
+        return generate()
+    
+    def _follow_logs(self, pods, backlog_started, last_seen, max_seconds=None):
+        """Emit lines written after the backlog, in arrival order"""
+        deadline = time.monotonic() + max_seconds if max_seconds else None
+        # Reach back past the backlog read; lines already sent are skipped below
+        since_seconds = math.ceil(time.time() - backlog_started) + LOG_FOLLOW_OVERLAP
+        
+        responses = []
+        for pod in pods:
+            try:
+                responses.append((pod, self._open_pod_log(pod, since_seconds=since_seconds, follow=True)))
+            except ApiException as e:
+                print(f"Error following logs for {pod}: {e}")
+        
+        # A quiet pod would stall a blocking merge, so each pod feeds a
+        # bounded queue and lines are emitted in arrival order
+        lines = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        stop = threading.Event()
+        done = object()
+        
+        def offer(item):
+            # Block while the client is slow, but give up once it disconnects
+            while not stop.is_set():
+                try:
+                    lines.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        def pump(pod, response):
+            try:
+                for key, line, _ in self._iter_log_lines(response, pod):
+                    if key <= last_seen.get(pod, ''):
+                        continue
+                    if not offer(line):
+                        return
+            except Exception as e:
+                print(f"Error streaming logs for {pod}: {e}")
+            finally:
+                offer(done)
+        
+        for pod, response in responses:
+            threading.Thread(target=pump, args=(pod, response), daemon=True).start()
+        
+        try:
+            remaining = len(responses)
+            while remaining:
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        return
+                try:
+                    line = lines.get(timeout=timeout)
+                except queue.Empty:
+                    return
+                if line is done:
+                    remaining -= 1
+                    continue
+                yield line
+        finally:
+            stop.set()
+            for _, response in responses:
+                try:
+                    response.close()
+                except Exception:
+                    pass
+
+
+def _log_sort_key(line):
+    """Build a sortable key from a Kubernetes RFC3339Nano log timestamp.
+    
+    Trailing zeros are trimmed from the fractional seconds, so the fraction is
+    padded before comparing to keep ordering correct.
+    """
+    stamp = line.split(' ', 1)[0]
+    if not stamp.endswith('Z'):
+        return ''
+    seconds, _, fraction = stamp[:-1].partition('.')
+    return f"{seconds}.{fraction.ljust(9, '0')}"
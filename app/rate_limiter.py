@@ -0,0 +1,62 @@
+import math
+import os
+import sqlite3
+import time
+from app.config import Config
+
+class RateLimiter:
+    """Per-user token bucket, shared by all gunicorn workers through SQLite"""
+
+    def __init__(self, rate=None, burst=None, path=None):
+        self.rate = rate if rate is not None else Config.RATE_LIMIT_PER_SECOND
+        self.burst = burst if burst is not None else Config.RATE_LIMIT_BURST
+        self.path = path or Config.API_STATE_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    user TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def acquire(self, user):
+        """Take one token for user. Returns (allowed, retry_after_seconds)"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM rate_limits WHERE user = ?",
+                (user,)
+            ).fetchone()
+            if row:
+                tokens = min(self.burst, row[0] + (now - row[1]) * self.rate)
+            else:
+                tokens = self.burst
+
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limits (user, tokens, updated_at) VALUES (?, ?, ?)",
+                (user, tokens, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        if allowed:
+            return True, 0
+        return False, max(1, math.ceil((1 - tokens) / self.rate))
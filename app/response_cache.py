@@ -0,0 +1,114 @@
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from app.config import Config
+
+class ResponseCache:
+    """Short-TTL cache shared by all gunicorn workers through SQLite.
+
+    Concurrent misses for the same key are coalesced: one caller takes a
+    lease and fetches, everyone else waits for its result instead of
+    hitting Kubernetes or GitHub again. Empty results are never cached,
+    since the backends return them on errors as well.
+    """
+
+    def __init__(self, path=None, lease_seconds=30, poll_interval=0.05):
+        self.path = path or Config.API_STATE_PATH
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT,
+                    expires_at REAL NOT NULL DEFAULT 0,
+                    lease_until REAL NOT NULL DEFAULT 0
+                )
+            """)
+
+    @contextmanager
+    def _transaction(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    def _lookup_or_lease(self, key, skip_hit=False):
+        """Return ('hit', value), ('lease', None) or ('wait', None)"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT value, expires_at, lease_until FROM response_cache WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row and row[1] > now and not skip_hit:
+                return 'hit', json.loads(row[0])
+            if row and row[2] > now:
+                return 'wait', None
+            conn.execute(
+                "INSERT INTO response_cache (key, lease_until) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET lease_until = excluded.lease_until",
+                (key, now + self.lease_seconds)
+            )
+            return 'lease', None
+
+    def get_or_fetch(self, key, ttl, fetch, refresh=False):
+        """Return the cached value for key, calling fetch() at most once per TTL.
+
+        refresh=True ignores the cached value (a fetch already in flight is
+        still shared).
+        """
+        deadline = time.monotonic() + self.lease_seconds
+        skip_hit = refresh
+        while True:
+            state, value = self._lookup_or_lease(key, skip_hit)
+            if state == 'hit':
+                return value
+            if state == 'lease':
+                break
+            # Whatever the lease holder fetches is newer than the refresh request
+            skip_hit = False
+            if time.monotonic() >= deadline:
+                # The lease holder is stuck; fetch without caching
+                return fetch()
+            time.sleep(self.poll_interval)
+
+        try:
+            value = fetch()
+        except Exception:
+            self._release(key)
+            raise
+
+        if not value:
+            # Could be a failed fetch; let the next read try again
+            self._release(key)
+            return value
+
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE response_cache SET value = ?, expires_at = ?, lease_until = 0 WHERE key = ?",
+                (json.dumps(value), time.time() + ttl, key)
+            )
+        return value
+
+    def _release(self, key):
+        with self._transaction() as conn:
+            conn.execute("UPDATE response_cache SET lease_until = 0 WHERE key = ?", (key,))
+
+    def invalidate(self, *keys):
+        """Drop cached values so the next read goes to the backend"""
+        with self._transaction() as conn:
+            conn.executemany(
+                "DELETE FROM response_cache WHERE key = ?",
+                [(key,) for key in keys]
+            )
@@ -0,0 +1,200 @@
+import os
+import sqlite3
+import threading
+import time
+from app.config import Config
+
+class ActivityTracker:
+    """Last-request times per app, shared by all workers through SQLite"""
+
+    def __init__(self, path=None, write_interval=10):
+        self.path = path or Config.API_STATE_PATH
+        self.write_interval = write_interval
+        self._last_written = {}
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS app_activity (
+                    name TEXT PRIMARY KEY,
+                    last_request REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS controller_leases (
+                    name TEXT PRIMARY KEY,
+                    holder INTEGER NOT NULL,
+                    lease_until REAL NOT NULL
+                )
+            """)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def record(self, name):
+        """Note a request for an app (writes at most once per write_interval)"""
+        now = time.time()
+        if now - self._last_written.get(name, 0) < self.write_interval:
+            return
+        self._last_written[name] = now
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO app_activity (name, last_request) VALUES (?, ?)",
+                (name, now)
+            )
+        finally:
+            conn.close()
+
+    def last_request(self, name):
+        """Return the time of the last request for an app, or None"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT last_request FROM app_activity WHERE name = ?",
+                (name,)
+            ).fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+    def try_lease(self, name, seconds):
+        """Take a lease so only one worker runs a periodic job at a time"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT holder, lease_until FROM controller_leases WHERE name = ?",
+                (name,)
+            ).fetchone()
+            if row and row[1] > now and row[0] != os.getpid():
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO controller_leases (name, holder, lease_until) VALUES (?, ?, ?)",
+                (name, os.getpid(), now + seconds)
+            )
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+
+class IdleController:
+    """Periodically scales managed deployments with no recent traffic to zero"""
+
+    def __init__(self, k8s_deployer, tracker, idle_seconds=None, interval=None, on_change=None):
+        self.k8s_deployer = k8s_deployer
+        self.tracker = tracker
+        # Called with the name of every deployment scaled to zero
+        self.on_change = on_change
+        self.idle_seconds = idle_seconds if idle_seconds is not None else Config.IDLE_TIMEOUT_SECONDS
+        self.interval = interval if interval is not None else Config.IDLE_CHECK_INTERVAL
+        self._thread = None
+
+    def start(self):
+        """Run the controller in a background thread (no-op if disabled)"""
+        if self.idle_seconds <= 0 or not self.k8s_deployer.configured or self._thread:
+            return
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                # Every gunicorn worker runs this loop; one of them does the work
+                if self.tracker.try_lease('idle-controller', self.interval * 2):
+                    self.run_once()
+            except Exception as e:
+                print(f"Idle controller error: {e}")
+
+    def run_once(self):
+        """Scale every idle managed deployment to zero. Returns the names slept"""
+        now = time.time()
+        slept = []
+        for deployment in self.k8s_deployer.list_managed_deployments():
+            name = deployment.metadata.name
+            if self.k8s_deployer.is_sleeping(deployment) or not deployment.spec.replicas:
+                continue
+
+            # A deployment that never saw traffic is idle from its creation time
+            last_active = self.tracker.last_request(name)
+            created = deployment.metadata.creation_timestamp
+            if created is not None:
+                last_active = max(last_active or 0, created.timestamp())
+            if last_active is None or now - last_active < self.idle_seconds:
+                continue
+
+            success, _ = self.k8s_deployer.sleep_deployment(name)
+            if success:
+                slept.append(name)
+                if self.on_change:
+                    self.on_change(name)
+        return slept
+
+
+class Activator:
+    """Wakes sleeping deployments on their first request and finds where to forward it"""
+
+    def __init__(self, k8s_deployer, tracker, awake_ttl=30, on_change=None):
+        self.k8s_deployer = k8s_deployer
+        self.tracker = tracker
+        self.awake_ttl = awake_ttl
+        # Called with the name of every deployment that may have been woken up
+        self.on_change = on_change
+        self._awake = {}
+
+    def is_managed(self, name):
+        """Check that name is an app deployed by this platform before touching it"""
+        cached = self._awake.get(name)
+        if cached and cached[0] > time.monotonic():
+            return True
+        return self.k8s_deployer.is_managed(name)
+
+    def activate(self, name):
+        """Record a request and make sure the app can serve it.
+
+        Returns (success, upstream_base_url or error message).
+        """
+        # Apps seen awake recently skip the Kubernetes round trips; the idle
+        # timeout is far longer than awake_ttl, so they cannot have gone to sleep
+        cached = self._awake.get(name)
+        if cached and cached[0] > time.monotonic():
+            self.tracker.record(name)
+            return True, cached[1]
+
+        success, message = self.k8s_deployer.wake_deployment(name)
+        if not success:
+            return False, message
+        self.tracker.record(name)
+        if self.on_change:
+            self.on_change(name)
+
+        # Forward as soon as one replica is available; the rest catch up
+        success, message = self.k8s_deployer.wait_for_ready(
+            name,
+            timeout=Config.ACTIVATOR_WAKE_TIMEOUT,
+            interval=0.5,
+            min_available=1
+        )
+        if not success:
+            return False, message
+
+        port = self.k8s_deployer.get_service_port(name)
+        if port is None:
+            return False, f"No service found for {name}"
+        upstream = Config.ACTIVATOR_UPSTREAM.format(
+            name=name,
+            namespace=self.k8s_deployer.namespace,
+            port=port
+        )
+        self._awake[name] = (time.monotonic() + self.awake_ttl, upstream)
+        return True, upstream
@@ -0,0 +1,201 @@
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+import requests
+from app.config import Config
+
+_current_trace = ContextVar('current_trace', default=None)
+_current_span = ContextVar('current_span', default=None)
+_file_lock = threading.Lock()
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    @property
+    def duration_ms(self):
+        end = self.end_ns or time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+
+class Trace:
+    """All spans of one deploy, plus attributes stamped on every span"""
+
+    def __init__(self, name, attributes=None):
+        self.trace_id = secrets.token_hex(16)
+        self.attributes = dict(attributes or {})
+        self.spans = []
+        self.root = self._new_span(name, None, {})
+
+    def _new_span(self, name, parent, attributes):
+        span = Span(name, self.trace_id, parent.span_id if parent else None, attributes)
+        self.spans.append(span)
+        return span
+
+    def timings(self):
+        """Per-span timing breakdown, in start order, for API responses"""
+        names = {span.span_id: span.name for span in self.spans}
+        return [{
+            'name': span.name,
+            'parent': names.get(span.parent_id),
+            'start_ms': round((span.start_ns - self.root.start_ns) / 1e6, 1),
+            'duration_ms': round(span.duration_ms, 1),
+            'error': span.error,
+        } for span in sorted(self.spans, key=lambda s: s.start_ns)]
+
+    def to_json(self):
+        return {
+            'trace_id': self.trace_id,
+            'attributes': self.attributes,
+            'spans': [{
+                'name': span.name,
+                'span_id': span.span_id,
+                'parent_id': span.parent_id,
+                'start_ns': span.start_ns,
+                'end_ns': span.end_ns,
+                'duration_ms': round(span.duration_ms, 3),
+                'attributes': {**self.attributes, **span.attributes},
+                'error': span.error,
+            } for span in self.spans],
+        }
+
+    def to_otlp(self):
+        """Encode as an OTLP/HTTP JSON ExportTraceServiceRequest"""
+        return {'resourceSpans': [{
+            'resource': {'attributes': _otlp_attributes({'service.name': Config.TRACE_SERVICE_NAME})},
+            'scopeSpans': [{
+                'scope': {'name': 'localkubelab'},
+                'spans': [{
+                    'traceId': self.trace_id,
+                    'spanId': span.span_id,
+                    'parentSpanId': span.parent_id or '',
+                    'name': span.name,
+                    'kind': 1,
+                    'startTimeUnixNano': str(span.start_ns),
+                    'endTimeUnixNano': str(span.end_ns or span.start_ns),
+                    'attributes': _otlp_attributes({**self.attributes, **span.attributes}),
+                    'status': {'code': 2, 'message': span.error} if span.error else {'code': 1},
+                } for span in self.spans],
+            }],
+        }]}
+
+
+@contextmanager
+def start_trace(name, **attributes):
+    """Trace a deploy. Nested calls just open a span in the outer trace"""
+    if _current_trace.get() is not None:
+        with span(name, **attributes):
+            yield _current_trace.get()
+        return
+
+    with activate(Trace(name, attributes)) as trace:
+        yield trace
+
+
+@contextmanager
+def activate(trace, finish=True):
+    """Make an existing trace current, e.g. to continue it on another thread.
+
+    With finish=True the trace ends and is exported when the block exits.
+    """
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(trace.root)
+    try:
+        yield trace
+    except Exception as e:
+        trace.root.error = str(e)
+        raise
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        if finish:
+            trace.root.end_ns = time.time_ns()
+            export(trace)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time a block as a child of the current span; a no-op outside a trace"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    current = trace._new_span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.error = str(e)
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current_span.reset(token)
+
+
+def set_trace_attributes(**attributes):
+    """Attach attributes (deploy ID, commit, ...) to every span of the current trace"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes.update({k: v for k, v in attributes.items() if v is not None})
+
+
+def export(trace):
+    """Send a finished trace to the configured exporter(s)"""
+    for exporter in filter(None, (e.strip() for e in Config.TRACE_EXPORTERS.split(','))):
+        try:
+            if exporter == 'json':
+                _export_json(trace)
+            elif exporter == 'otlp':
+                _export_otlp(trace)
+            else:
+                print(f"Unknown trace exporter: {exporter}")
+        except Exception as e:
+            print(f"Error exporting trace to {exporter}: {e}")
+
+
+def _export_json(trace):
+    path = Config.TRACE_JSON_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    line = json.dumps(trace.to_json())
+    with _file_lock, open(path, 'a', encoding='utf-8') as f:
+        f.write(line + '\n')
+
+
+def _export_otlp(trace):
+    response = requests.post(
+        Config.OTLP_ENDPOINT,
+        json=trace.to_otlp(),
+        headers={'Content-Type': 'application/json'},
+        timeout=5
+    )
+    if response.status_code >= 300:
+        print(f"OTLP collector rejected trace: {response.status_code} {response.text[:200]}")
+
+
+def _otlp_attributes(attributes):
+    encoded = []
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            encoded.append({'key': key, 'value': {'boolValue': value}})
+        elif isinstance(value, int):
+            encoded.append({'key': key, 'value': {'intValue': str(value)}})
+        elif isinstance(value, float):
+            encoded.append({'key': key, 'value': {'doubleValue': value}})
+        else:
+            encoded.append({'key': key, 'value': {'stringValue': str(value)}})
+    return encoded
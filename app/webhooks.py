@@ -0,0 +1,252 @@
+import hashlib
+import hmac
+import os
+import sqlite3
+import threading
+import time
+from app.config import Config
+
+def verify_signature(secret, body, signature_header):
+    """Check a GitHub X-Hub-Signature-256 header against the raw request body"""
+    if not secret or not signature_header or not signature_header.startswith('sha256='):
+        return False
+    expected = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature_header[len('sha256='):])
+
+
+class WebhookRedeployer:
+    """Turns GitHub push events into debounced redeploys of existing deployments.
+
+    Pushes are not built right away: each one (re)schedules its deployments
+    DEBOUNCE seconds into the future, so a burst of pushes ends up as a single
+    build of the newest commit. A steady stream of pushes is still built at
+    most MAX_WAIT seconds after the first one. A pending redeploy stays in the
+    table, claimed by the worker building it, until that build has finished.
+    """
+
+    def __init__(self, deploy_pipeline, path=None, debounce_seconds=None, poll_interval=2):
+        self.deploy_pipeline = deploy_pipeline
+        self.path = path or Config.API_STATE_PATH
+        self.debounce_seconds = debounce_seconds if debounce_seconds is not None else Config.WEBHOOK_DEBOUNCE_SECONDS
+        self.max_wait_seconds = Config.WEBHOOK_MAX_WAIT_SECONDS
+        self.claim_seconds = Config.WEBHOOK_CLAIM_SECONDS
+        self.poll_interval = poll_interval
+        self._thread = None
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS webhook_targets (
+                    repo_key TEXT NOT NULL,
+                    branch TEXT NOT NULL,
+                    deployment TEXT NOT NULL,
+                    repo_url TEXT NOT NULL,
+                    replicas INTEGER NOT NULL,
+                    PRIMARY KEY (repo_key, branch, deployment)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS webhook_pending (
+                    deployment TEXT PRIMARY KEY,
+                    repo_url TEXT NOT NULL,
+                    branch TEXT NOT NULL,
+                    commit_sha TEXT,
+                    replicas INTEGER NOT NULL,
+                    due_at REAL NOT NULL
+                )
+            """)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(webhook_pending)")}
+            for column, definition in (('first_push_at', 'REAL NOT NULL DEFAULT 0'),
+                                       ('generation', 'INTEGER NOT NULL DEFAULT 0'),
+                                       ('claimed_until', 'REAL NOT NULL DEFAULT 0')):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE webhook_pending ADD COLUMN {column} {definition}")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def register(self, repo_url, branch, deployment, replicas=2):
+        """Redeploy deployment whenever branch of repo_url is pushed"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # A deployment follows exactly one repo and branch
+            conn.execute("DELETE FROM webhook_targets WHERE deployment = ?", (deployment,))
+            conn.execute(
+                "INSERT INTO webhook_targets (repo_key, branch, deployment, repo_url, replicas) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (_repo_key(repo_url), branch, deployment, repo_url, replicas)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def unregister(self, deployment):
+        """Stop redeploying a deployment on pushes"""
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM webhook_targets WHERE deployment = ?", (deployment,))
+            conn.execute("DELETE FROM webhook_pending WHERE deployment = ?", (deployment,))
+        finally:
+            conn.close()
+
+    def handle_push(self, payload):
+        """Schedule redeploys for a push event. Returns the deployments scheduled"""
+        ref = payload.get('ref') or ''
+        if not ref.startswith('refs/heads/') or payload.get('deleted'):
+            return []
+        branch = ref[len('refs/heads/'):]
+        repository = payload.get('repository') or {}
+        keys = {_repo_key(u) for u in (repository.get('clone_url'), repository.get('html_url')) if u}
+        if not keys:
+            return []
+
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            targets = conn.execute(
+                f"SELECT repo_url, deployment, replicas FROM webhook_targets "
+                f"WHERE branch = ? AND repo_key IN ({','.join('?' * len(keys))})",
+                (branch, *keys)
+            ).fetchall()
+            now = time.time()
+            for repo_url, deployment, replicas in targets:
+                # Each push pushes the build back, but never past MAX_WAIT after the first
+                conn.execute(
+                    "INSERT INTO webhook_pending "
+                    "(deployment, repo_url, branch, commit_sha, replicas, due_at, first_push_at, generation) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, 1) "
+                    "ON CONFLICT (deployment) DO UPDATE SET "
+                    "repo_url = excluded.repo_url, branch = excluded.branch, commit_sha = excluded.commit_sha, "
+                    "replicas = excluded.replicas, generation = generation + 1, "
+                    "due_at = MIN(excluded.due_at, first_push_at + ?)",
+                    (deployment, repo_url, branch, payload.get('after'), replicas,
+                     now + self.debounce_seconds, now, self.max_wait_seconds)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return [deployment for _, deployment, _ in targets]
+
+    def start(self):
+        """Process due redeploys in a background thread"""
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.run_due()
+            except Exception as e:
+                print(f"Webhook redeploy error: {e}")
+
+    def _claim_due(self):
+        """Atomically claim one due redeploy so only one worker builds it"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT deployment, repo_url, branch, commit_sha, replicas, generation FROM webhook_pending "
+                "WHERE due_at <= ? AND claimed_until < ? ORDER BY due_at LIMIT 1",
+                (now, now)
+            ).fetchone()
+            if row:
+                # The row stays until the build is done; if this worker dies
+                # the claim runs out and another worker picks it up
+                conn.execute(
+                    "UPDATE webhook_pending SET claimed_until = ? WHERE deployment = ?",
+                    (now + self.claim_seconds, row[0])
+                )
+            conn.execute("COMMIT")
+            return row
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _complete(self, deployment, generation):
+        """Drop a built redeploy, unless newer pushes arrived during the build"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "DELETE FROM webhook_pending WHERE deployment = ? AND generation = ?",
+                (deployment, generation)
+            )
+            # Newer pushes start a fresh MAX_WAIT window
+            conn.execute(
+                "UPDATE webhook_pending SET claimed_until = 0, first_push_at = ? WHERE deployment = ?",
+                (time.time(), deployment)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _release(self, deployment, delay):
+        """Give up a claim and try again after delay seconds"""
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE webhook_pending SET claimed_until = 0, due_at = ? WHERE deployment = ?",
+                (time.time() + delay, deployment)
+            )
+        finally:
+            conn.close()
+
+    def run_due(self):
+        """Build every redeploy whose debounce window has passed"""
+        while True:
+            row = self._claim_due()
+            if not row:
+                return
+            deployment, repo_url, branch, commit_sha, replicas, generation = row
+            print(f"Redeploying {deployment} from {branch} ({commit_sha})")
+            try:
+                # The pipeline builds the newest commit on the branch, which
+                # covers every push that was folded into this one
+                success, result, stage = self.deploy_pipeline.run(
+                    repo_url=repo_url,
+                    name=deployment,
+                    replicas=replicas,
+                    branch=branch,
+                    trigger='webhook'
+                )
+            except Exception:
+                self._release(deployment, self.debounce_seconds)
+                raise
+            if stage == 'conflict':
+                # Another worker or a dashboard deploy holds the workspace
+                self._release(deployment, self.debounce_seconds)
+                continue
+            self._complete(deployment, generation)
+            if not success:
+                print(f"Redeploy of {deployment} failed at {stage}: {result}")
+            else:
+                print(f"Redeployed {deployment} at {result['commit']}")
+
+def _repo_key(url):
+    """Compare clone_url/html_url forms of the same GitHub repository"""
+    url = url.strip().rstrip('/')
+    if url.endswith('.git'):
+        url = url[:-len('.git')]
+    return url.lower()
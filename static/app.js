@@ -33,12 +33,12 @@ document.querySelectorAll('.menu-item').forEach(item => {
 });
 
 // Load repositories
-async function loadRepositories() {
+async function loadRepositories(refresh = false) {
     if (reposLoading) reposLoading.style.display = 'block';
     if (reposContainer) reposContainer.innerHTML = '';
     
     try {
-        const response = await fetch('/api/repos');
+        const response = await fetch(refresh ? '/api/repos?refresh=1' : '/api/repos');
         const data = await response.json();
         
         if (data.repos) {
@@ -120,7 +120,15 @@ async function deployRepository(repoUrl, repoName) {
             })
         });
         
-        const data = await response.json();
+        let data = await response.json();
+        
+        // The deploy runs in the background; poll until it finishes
+        while (data.success && data.status === 'running') {
+            await new Promise(resolve => setTimeout(resolve, 2000));
+            const status = await fetch(`/api/deploy/${data.deploy_id}`);
+            data = await status.json();
+            markFinishedStages(data.stages || []);
+        }
         
         if (data.success) {
             // Mark all stages as success
@@ -129,11 +137,12 @@ async function deployRepository(repoUrl, repoName) {
                 stage.querySelector('.stage-icon').textContent = '✅';
             });
             
-            showDeployResult(true, `Successfully deployed ${repoName}!<br>Image: ${data.image}<br>Deployment: ${data.deployment}`);
+            const imageSize = data.image_size ? ` (${(data.image_size / (1024 * 1024)).toFixed(1)} MB)` : '';
+            showDeployResult(true, `Successfully deployed ${repoName}!<br>Image: ${data.image}${imageSize}<br>Deployment: ${data.deployment}`);
         } else {
             // Mark error stage
             const errorStage = data.stage || 'unknown';
-            document.getElementById(`stage-${errorStage.split('_')[0]}`).classList.add('error');
+            document.getElementById(`stage-${errorStage.split('_')[0]}`)?.classList.add('error');
             
             showDeployResult(false, `Deployment failed: ${data.error}`);
         }
@@ -143,6 +152,19 @@ async function deployRepository(repoUrl, repoName) {
     }
 }
 
+// Tick off dashboard stages as the pipeline stages behind them finish
+const STAGE_DONE = {build: 'docker', push: 'push', ready: 'k8s'};
+
+function markFinishedStages(stages) {
+    stages.forEach(stage => {
+        const element = STAGE_DONE[stage] && document.getElementById(`stage-${STAGE_DONE[stage]}`);
+        if (element) {
+            element.classList.add('success');
+            element.querySelector('.stage-icon').textContent = '✅';
+        }
+    });
+}
+
 // Show deploy result
 function showDeployResult(success, message) {
     const resultDiv = document.getElementById('deploy-result');
@@ -152,12 +174,12 @@ function showDeployResult(success, message) {
 }
 
 // Load deployments
-async function loadDeployments() {
+async function loadDeployments(refresh = false) {
     if (deploymentsLoading) deploymentsLoading.style.display = 'block';
     if (deploymentsContainer) deploymentsContainer.innerHTML = '';
     
     try {
-        const response = await fetch('/api/deployments');
+        const response = await fetch(refresh ? '/api/deployments?refresh=1' : '/api/deployments');
         const data = await response.json();
         
         if (data.deployments) {
@@ -189,17 +211,19 @@ function displayDeployments(deploymentsToDisplay) {
         const deploymentCard = document.createElement('div');
         deploymentCard.className = 'deployment-card';
         
+        const isSleeping = deployment.state === 'sleeping';
         const isHealthy = deployment.available_replicas === deployment.replicas;
-        const statusColor = isHealthy ? 'var(--success-color)' : 'var(--warning-color)';
+        const statusColor = isSleeping ? 'var(--text-secondary)' : (isHealthy ? 'var(--success-color)' : 'var(--warning-color)');
+        const statusText = isSleeping ? '💤 Sleeping' : (isHealthy ? '✅ Healthy' : '⚠️ Unhealthy');
         
-        // Construct the app URL
-        const appUrl = `http://localhost:${deployment.port}`;
+        // Each app has its own host behind the activator, which wakes sleeping apps
+        const appUrl = deployment.url;
         
         deploymentCard.innerHTML = `
             <div class="deployment-header">
                 <h3>${deployment.name}</h3>
                 <span style="color: ${statusColor};">
-                    ${isHealthy ? '✅ Healthy' : '⚠️ Unhealthy'}
+                    ${statusText}
                 </span>
             </div>
             <div class="deployment-status">
@@ -223,6 +247,12 @@ function displayDeployments(deploymentsToDisplay) {
                 <button class="btn btn-secondary" onclick="viewDeploymentDetails('${deployment.name}')">
                     📊 Details
                 </button>
+                <button class="btn btn-secondary" onclick="viewDeploymentLogs('${deployment.name}')">
+                    📜 Logs
+                </button>
+                <button class="btn btn-secondary" onclick="viewDeploymentLogs('${deployment.name}', true)">
+                    📡 Follow
+                </button>
                 <button class="btn btn-danger" onclick="deleteDeployment('${deployment.name}')">
                     🗑️ Delete
                 </button>
@@ -246,6 +276,11 @@ async function viewDeploymentDetails(name) {
     }
 }
 
+// View deployment logs (last 500 lines, optionally following new output)
+function viewDeploymentLogs(name, follow = false) {
+    window.open(`/api/deployment/${name}/logs?tailLines=500${follow ? '&follow=true' : ''}`, '_blank');
+}
+
 // Delete deployment
 async function deleteDeployment(name) {
     if (!confirm(`Are you sure you want to delete deployment "${name}"?`)) {
@@ -272,8 +307,9 @@ async function deleteDeployment(name) {
 }
 
 // Refresh buttons
-document.getElementById('refresh-repos')?.addEventListener('click', loadRepositories);
-document.getElementById('refresh-deployments')?.addEventListener('click', loadDeployments);
+// Refresh buttons bypass the server-side cache
+document.getElementById('refresh-repos')?.addEventListener('click', () => loadRepositories(true));
+document.getElementById('refresh-deployments')?.addEventListener('click', () => loadDeployments(true));
 
 // Close modal
 document.querySelector('.close')?.addEventListener('click', () => {